@@ -1,37 +1,121 @@
 from flask import Flask, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from marshmallow import Schema, fields, ValidationError, validate
+from sqlalchemy import and_, event, exists, inspect, or_, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.schema import CreateIndex
+from datetime import datetime, timedelta, timezone
+from marshmallow import Schema, fields, ValidationError, validate, EXCLUDE
+from marshmallow.utils import from_iso_datetime
 from uuid import uuid4
+from functools import lru_cache
 from typing import Optional
+import atexit
+import logging
+import logging.handlers
+import math
 import os
+import queue
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; Flask's stdlib json provider is used instead
+    orjson = None
+
+try:
+    import redis
+except ImportError:  # only needed when REDIS_URL is set
+    redis = None
 
 # Load environment variables (if any) from .env
 load_dotenv()
 
 # Flask app
 app = Flask(__name__)
+IS_PROD = os.getenv("ENV") == "prod"
+
+# --- JSON: orjson (C) for request parsing and response bodies ---
+class OrjsonProvider(DefaultJSONProvider):
+    OPTIONS = (orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.OPTIONS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 
 # --- Database (SQLite for local development) ---
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", "sqlite:///hospital.db")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+_db_url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+SQLITE_FILE_DB = _db_url.get_backend_name() == "sqlite" and _db_url.database not in (None, "", ":memory:")
+if SQLITE_FILE_DB:
+    # SQLAlchemy already pools file connections (QueuePool, size 5). Keep 10, so
+    # the 8 request threads per worker (see wsgi.py) hold on to their
+    # connections; overflow connections are closed on return and reconnecting
+    # re-runs the PRAGMAs below. Lock waits use PRAGMA busy_timeout.
+    # In-memory SQLite gets a StaticPool from Flask-SQLAlchemy.
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"pool_size": 10}
 db = SQLAlchemy(app)
 
+# SQLite tuning: WAL lets readers proceed while the single writer commits.
+# Skipped for in-memory databases (tests), where WAL does not apply.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+)
+
+with app.app_context():
+    if SQLITE_FILE_DB:
+        @event.listens_for(db.engine, "connect")
+        def _sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+            cursor.close()
+
 # Allow cross-origin requests during development
 CORS(app)
 
 # ---- DEBUG: Log every incoming request (method, path, key headers) ----
-@app.before_request
+# Request threads only enqueue records; a QueueListener thread writes to stderr.
+# Disabled in production, so workers do not start the listener thread at all.
+req_logger = logging.getLogger("req")
+
 def _log_req():
-    print(
-        "REQ:", request.method, request.path,
-        "| CT:", request.headers.get("Content-Type"),
-        "| X-API-Key:", bool(request.headers.get("X-API-Key")),
-        "| Idem:", request.headers.get("Idempotency-Key")
+    req_logger.info(
+        "REQ: %s %s | CT: %s | X-API-Key: %s | Idem: %s",
+        request.method, request.path,
+        request.headers.get("Content-Type"),
+        bool(request.headers.get("X-API-Key")),
+        request.headers.get("Idempotency-Key")
     )
 
+if not IS_PROD:
+    if not req_logger.handlers:
+        _log_queue = queue.SimpleQueue()
+        _log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
+        req_logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+        req_logger.setLevel(logging.INFO)
+        req_logger.propagate = False
+    app.before_request(_log_req)
+
 # ------------------------- MODELS -------------------------
 class Patient(db.Model):
     id = db.Column(db.String, primary_key=True)
@@ -47,10 +131,16 @@ class Device(db.Model):
     status = db.Column(db.String, default="active")
     api_key = db.Column(db.String, nullable=False)  # per-device API key (issued at register)
 
+    patient = db.relationship("Patient", lazy="raise")
+
 class Vital(db.Model):
+    # (patient_id, timestamp, id) serves /latest and /history as an ordered range
+    # scan; id breaks timestamp ties for the keyset cursor
+    __table_args__ = (db.Index("ix_vital_patient_ts_id", "patient_id", "timestamp", "id"),)
+
     id = db.Column(db.String, primary_key=True)
-    patient_id = db.Column(db.String, db.ForeignKey("patient.id"), index=True)
-    timestamp = db.Column(db.DateTime, index=True)
+    patient_id = db.Column(db.String, db.ForeignKey("patient.id"))
+    timestamp = db.Column(db.BigInteger, index=True)  # UTC epoch milliseconds
     heart_rate = db.Column(db.Integer)
     bp_systolic = db.Column(db.Integer)
     bp_diastolic = db.Column(db.Integer)
@@ -58,6 +148,11 @@ class Vital(db.Model):
     temp = db.Column(db.Float)
     device_id = db.Column(db.String, db.ForeignKey("device.id"))
 
+    # N+1 guard: lazy loads raise, so per-row access must opt in to one JOIN with
+    # Vital.query.options(joinedload(Vital.device), joinedload(Vital.patient))
+    patient = db.relationship("Patient", lazy="raise")
+    device = db.relationship("Device", lazy="raise")
+
 class Alert(db.Model):
     id = db.Column(db.String, primary_key=True)
     patient_id = db.Column(db.String, index=True)
@@ -74,6 +169,12 @@ class IdempotencyKey(db.Model):
     key = db.Column(db.String, unique=True, index=True, nullable=False)  # device_id:idempotency_key
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+# Columns returned by /latest and /history; queried as plain tuples (no ORM objects)
+VITAL_COLUMNS = (
+    Vital.timestamp, Vital.heart_rate, Vital.bp_systolic, Vital.bp_diastolic,
+    Vital.spo2, Vital.temp, Vital.device_id,
+)
+
 # ------------------------- SCHEMAS (validation) -------------------------
 class BPField(Schema):
     systolic = fields.Integer(required=True, validate=validate.Range(min=0, max=300))
@@ -86,14 +187,144 @@ class VitalInSchema(Schema):
     spo2 = fields.Integer(allow_none=True)
     temp = fields.Float(allow_none=True)
     device_id = fields.String(required=True)
+    idempotency_key = fields.String(allow_none=True)  # body fallback for the header
 
 class DeviceRegisterSchema(Schema):
     device_id = fields.String(required=True)
     type = fields.String(required=True, validate=validate.OneOf(["hr", "bp", "spo2", "temp", "multi"]))
     patient_id = fields.String(required=True)
 
+# Built once at import; schema construction walks the field registry
+_DEVICE_SCHEMA = DeviceRegisterSchema(unknown=EXCLUDE)
+
+# Hand-written loaders for the ingestion hot path. They mirror VitalInSchema
+# (kept above as the reference/docs) without marshmallow's per-field dispatch.
+# Errors use marshmallow's message shape; see load_vital for the differences.
+_MISSING = "Missing data for required field."
+_NULL = "Field may not be null."
+
+def _load_int(value, name: str, errors: dict, lo=None, hi=None):
+    try:
+        # Like fields.Integer: floats are truncated (72.5 -> 72), bools rejected
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError
+        value = int(value)
+    except ValueError:
+        errors[name] = ["Not a valid integer."]
+        return None
+    except OverflowError:
+        errors[name] = ["Number too large."]
+        return None
+    if (lo is not None and value < lo) or (hi is not None and value > hi):
+        errors[name] = [f"Must be greater than or equal to {lo} and less than or equal to {hi}."]
+        return None
+    return value
+
+def load_vital(raw) -> dict:
+    """
+    Validate one vital payload like VitalInSchema().load(raw), except:
+    - unknown keys are ignored instead of reported as "Unknown field.";
+    - numbers given as strings ("72") are rejected instead of coerced.
+    """
+    if not isinstance(raw, dict):
+        raise ValidationError({"_schema": ["Invalid input type."]})
+    data, errors = {}, {}
+
+    ts = raw.get("timestamp")
+    if ts is None:
+        errors["timestamp"] = [_NULL if "timestamp" in raw else _MISSING]
+    else:
+        try:
+            # The parser fields.DateTime uses; unlike fromisoformat it is the same
+            # on every Python version and rejects "2025-08-13" / "20250813T120000"
+            data["timestamp"] = from_iso_datetime(ts) if isinstance(ts, str) else None
+        except ValueError:
+            pass
+        if data.get("timestamp") is None:
+            errors["timestamp"] = ["Not a valid datetime."]
+
+    device_id = raw.get("device_id")
+    if device_id is None:
+        errors["device_id"] = [_NULL if "device_id" in raw else _MISSING]
+    elif not isinstance(device_id, str):
+        errors["device_id"] = ["Not a valid string."]
+    else:
+        data["device_id"] = device_id
+
+    for name in ("heart_rate", "spo2"):
+        if name in raw:
+            value = raw[name]
+            data[name] = None if value is None else _load_int(value, name, errors)
+
+    if "temp" in raw:
+        value = raw["temp"]
+        if value is None:
+            data["temp"] = None
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            errors["temp"] = ["Not a valid number."]
+        elif isinstance(value, float) and not math.isfinite(value):  # stdlib json accepts NaN/Infinity
+            errors["temp"] = ["Special numeric values (nan or infinity) are not permitted."]
+        else:
+            try:
+                data["temp"] = float(value)
+            except OverflowError:
+                errors["temp"] = ["Number too large."]
+
+    if "bp" in raw:
+        bp, bp_errors = raw["bp"], {}
+        if not isinstance(bp, dict):
+            errors["bp"] = [_NULL] if bp is None else {"_schema": ["Invalid input type."]}
+        else:
+            out = {}
+            for name, hi in (("systolic", 300), ("diastolic", 200)):
+                if bp.get(name) is None:
+                    bp_errors[name] = [_NULL if name in bp else _MISSING]
+                else:
+                    out[name] = _load_int(bp[name], name, bp_errors, 0, hi)
+            if bp_errors:
+                errors["bp"] = bp_errors
+            data["bp"] = out
+
+    if "idempotency_key" in raw:
+        key = raw["idempotency_key"]
+        if key is not None and not isinstance(key, str):
+            errors["idempotency_key"] = ["Not a valid string."]
+        else:
+            data["idempotency_key"] = key
+
+    if errors:
+        raise ValidationError(errors)
+    return data
+
+def load_vitals(raw) -> list:
+    """Validate a list of vital payloads; errors are keyed by item index."""
+    if not isinstance(raw, list):
+        raise ValidationError({"_schema": ["Invalid input type."]})
+    records, errors = [], {}
+    for i, item in enumerate(raw):
+        try:
+            records.append(load_vital(item))
+        except ValidationError as e:
+            errors[i] = e.messages
+    if errors:
+        raise ValidationError(errors)
+    return records
+
 # ------------------------- HELPERS / CONFIG -------------------------
 DEVICE_MASTER_KEY = os.getenv("DEVICE_MASTER_KEY", "dev-master-key-123")
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 86400))  # seconds (Redis backend only)
+MAX_BATCH_SIZE = 1000  # readings per /vitals:batch request
+LATEST_CACHE_TTL = int(os.getenv("LATEST_CACHE_TTL", 3600))  # seconds (Redis backend only)
+
+# Optional Redis for idempotency keys and the /latest cache; both fall back to
+# SQLite when REDIS_URL is unset
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    if redis is None:
+        raise RuntimeError("REDIS_URL is set but the redis package is not installed")
+    redis_client = redis.Redis.from_url(REDIS_URL)
+else:
+    redis_client = None
 
 def uid(prefix: str) -> str:
     return f"{prefix}_{uuid4().hex[:12]}"
@@ -105,6 +336,18 @@ def error(code: str, http: int, message: str, details=None):
         payload["details"] = details
     return payload, http
 
+@lru_cache(maxsize=4096)
+def _lookup_device_by_key(api_key: str) -> str:
+    """
+    Resolve a per-device API key to its device id.
+    Unknown keys raise KeyError, which lru_cache does not store, so only valid
+    keys are cached and probes with random keys cannot evict them.
+    """
+    device_id = db.session.query(Device.id).filter_by(api_key=api_key).scalar()
+    if device_id is None:
+        raise KeyError(api_key)
+    return device_id
+
 def require_device_api_key():
     """Simple device/master key auth for write operations."""
     supplied = request.headers.get("X-API-Key")
@@ -112,35 +355,164 @@ def require_device_api_key():
         return False, error("missing_api_key", 401, "X-API-Key header required")
     if supplied == DEVICE_MASTER_KEY:
         return True, None
-    if Device.query.filter_by(api_key=supplied).first():
-        return True, None
-    return False, error("invalid_api_key", 401, "Invalid API key")
+    try:
+        _lookup_device_by_key(supplied)
+    except KeyError:
+        return False, error("invalid_api_key", 401, "Invalid API key")
+    return True, None
+
+@lru_cache(maxsize=64)
+def _parse_iso(s: str) -> datetime:
+    # Small cache: clients paging /history resend the same from/to values
+    if s[-1] == "Z":
+        s = s[:-1] + "+00:00"
+    return datetime.fromisoformat(s)
 
 def parse_dt(s: Optional[str]) -> Optional[datetime]:
     """Parse ISO-8601 strings (supports trailing Z)."""
     if not s:
         return None
     try:
-        s = s.replace("Z", "+00:00")
-        return datetime.fromisoformat(s)
+        return _parse_iso(s)
     except Exception:
         raise ValueError(f"Invalid datetime: {s}")
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MS = timedelta(milliseconds=1)
+
+def to_epoch_ms(dt: datetime) -> int:
+    """Convert a datetime to UTC epoch milliseconds (naive values are taken as UTC)."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // _MS
+
+def format_epoch_ms(ms: int) -> str:
+    """Render epoch milliseconds as ISO-8601 UTC with a trailing Z."""
+    return (_EPOCH + ms * _MS).replace(tzinfo=None).isoformat() + "Z"
+
+def parse_ts_ms(s: Optional[str]) -> Optional[int]:
+    """Parse a query-string timestamp given as epoch milliseconds or ISO-8601."""
+    if not s:
+        return None
+    if s.isdigit():
+        return int(s)
+    return to_epoch_ms(parse_dt(s))
+
+def parse_cursor(s: Optional[str]) -> Optional[tuple]:
+    """
+    Parse a /history cursor into (timestamp_ms, vital_id).
+    next_cursor is "<epoch_ms>:<vital_id>"; a bare timestamp (ISO-8601 or ms)
+    is still accepted and yields vital_id None (seek strictly before it).
+    """
+    if not s:
+        return None
+    head, sep, tail = s.partition(":")
+    if sep and head.isdigit():
+        return int(head), tail
+    return parse_ts_ms(s), None
+
 
-def record_idempotency(device_id: str, idem_key: Optional[str]) -> bool:
+def stage_idempotency(device_id: str, idem_key: Optional[str]) -> bool:
     """
     Return True if (device_id, idem_key) has NOT been seen before (safe to process).
     Return False if duplicate (should be ignored gracefully).
     If client does not send an idempotency key, treat as new (True).
+    Uses an atomic Redis SET NX with TTL when configured, else the SQLite table.
+    The SQLite row is only staged; the caller commits it together with its data.
     """
     if not idem_key:
         return True
-    combined = f"{device_id}:{idem_key}"
-    if IdempotencyKey.query.filter_by(key=combined).first():
-        return False
-    db.session.add(IdempotencyKey(device_id=device_id, key=combined))
-    db.session.commit()
-    return True
+    if redis_client is not None:
+        return bool(redis_client.set(f"idem:{device_id}:{idem_key}", "1", nx=True, ex=IDEMPOTENCY_TTL))
+    # Single INSERT OR IGNORE against the UNIQUE key: rowcount 0 means duplicate
+    res = db.session.execute(
+        IdempotencyKey.__table__.insert().prefix_with("OR IGNORE"),
+        {"device_id": device_id, "key": f"{device_id}:{idem_key}"},
+    )
+    return res.rowcount == 1
+
+def release_idempotency(device_id: str, idem_key: Optional[str]) -> None:
+    """
+    Forget a Redis idempotency key whose data was never committed, so the
+    client's retry is accepted. SQLite keys roll back with the data instead.
+    """
+    if idem_key and redis_client is not None:
+        redis_client.delete(f"idem:{device_id}:{idem_key}")
+
+def latest_cache_key(patient_id: str) -> str:
+    """
+    Current Redis key for the patient's cached /latest payload.
+    Keys carry a generation number that every write bumps, so a backfill that
+    read the database before the write lands under a dead key.
+    """
+    gen = redis_client.get(f"latest:gen:{patient_id}")
+    return f"latest:{patient_id}:{int(gen or 0)}"
+
+def invalidate_latest(patient_id: str) -> None:
+    """Retire the cached /latest payload after new readings are committed."""
+    if redis_client is None:
+        return
+    try:
+        redis_client.incr(f"latest:gen:{patient_id}")
+    except redis.RedisError as e:
+        # Readers may see the previous reading until LATEST_CACHE_TTL expires
+        app.logger.warning("latest cache invalidation failed for %s: %s", patient_id, e)
+
+def vital_row(patient_id: str, data: dict) -> dict:
+    """Map a validated vital payload (see load_vital) to Vital column values."""
+    bp = data.get("bp") or {}
+    return {
+        "id": uid("v"),
+        "patient_id": patient_id,
+        "timestamp": to_epoch_ms(data["timestamp"]),
+        "heart_rate": data.get("heart_rate"),
+        "bp_systolic": bp.get("systolic"),
+        "bp_diastolic": bp.get("diastolic"),
+        "spo2": data.get("spo2"),
+        "temp": data.get("temp"),
+        "device_id": data["device_id"],
+    }
+
+# Indexes from earlier schema versions, now covered by ix_vital_patient_ts_id
+_OBSOLETE_VITAL_INDEXES = ("ix_vital_patient_id", "ix_vital_patient_ts")
+# Stored in PRAGMA user_version once upgrade_vital_table() has run
+SCHEMA_VERSION = 1
+
+def schema_version(conn) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+def upgrade_vital_table(conn) -> None:
+    """
+    One-shot upgrade of a vital table created by an older release.
+    create_all() never alters existing tables, so convert legacy DATETIME text
+    timestamps to epoch ms in place and build any missing indexes, then record
+    SCHEMA_VERSION in PRAGMA user_version. Does nothing once that is current.
+    """
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return
+    if inspect(conn).has_table("vital"):
+        # julianday() reads SQLite's DATETIME text (naive UTC) with ms precision
+        conn.execute(text(
+            "UPDATE vital SET timestamp = "
+            "CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER) "
+            "WHERE typeof(timestamp) = 'text'"
+        ))
+        for name in _OBSOLETE_VITAL_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        for index in Vital.__table__.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+    # No table yet: create_all() will build it at the current version
+    conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+if SQLITE_FILE_DB:
+    # Upgrade an existing database file (e.g. instance/hospital.db) on first
+    # start. Later starts only read user_version; no write lock is taken.
+    with app.app_context(), db.engine.connect() as conn:
+        if schema_version(conn) < SCHEMA_VERSION:
+            # Workers booting together queue here; the loser sees the new version
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            upgrade_vital_table(conn)
+            conn.commit()
 
 # ------------------------- ADMIN (local utilities) -------------------------
 @app.get("/admin/routes")
@@ -167,9 +539,10 @@ def init_db():
     if request.method == "GET" and request.args.get("confirm") != "yes":
         return {"message": "Use POST or call /admin/init-db?confirm=yes (local only)"}, 200
     db.create_all()
-    if not Patient.query.get("p_001"):
+    upgrade_vital_table(db.session.connection())
+    if not db.session.query(exists().where(Patient.id == "p_001")).scalar():
         db.session.add(Patient(id="p_001", name="Demo Patient"))
-        db.session.commit()
+    db.session.commit()
     print("SQLite file:", os.path.abspath(db.engine.url.database))
     return {"status": "initialized"}, 201
 
@@ -180,18 +553,17 @@ def register_device():
     if not ok:
         return resp
     try:
-        body = DeviceRegisterSchema().load(request.get_json())
+        body = _DEVICE_SCHEMA.load(request.get_json(silent=True) or {})
     except ValidationError as e:
         return error("validation_error", 400, "Invalid payload", e.messages)
 
     # if patient doesn't exist, create (local convenience)
-    patient = Patient.query.get(body["patient_id"])
-    if not patient:
+    if not db.session.query(exists().where(Patient.id == body["patient_id"])).scalar():
         patient = Patient(id=body["patient_id"], name=f"Patient {body['patient_id']}")
         db.session.add(patient)
 
-    #  idempotent-ish: same device_id -> return existing
-    existing = Device.query.get(body["device_id"])
+    #  idempotent-ish: same device_id -> return existing (columns only, no ORM row)
+    existing = db.session.query(Device.id, Device.api_key).filter_by(id=body["device_id"]).first()
     if existing:
         return {
             "device_id": existing.id,
@@ -218,79 +590,157 @@ def post_vitals(patient_id):
     if not ok:
         return resp
     try:
-        data = VitalInSchema().load(request.get_json())
+        data = load_vital(request.get_json(silent=True) or {})
     except ValidationError as e:
         return error("validation_error", 400, "Invalid payload", e.messages)
 
     # Idempotency: prefer header, fallback to body
-    idem = request.headers.get("Idempotency-Key") or (request.json or {}).get("idempotency_key")
-    if not record_idempotency(data["device_id"], idem):
+    idem = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    if not stage_idempotency(data["device_id"], idem):
+        db.session.rollback()
         return {"status": "duplicate_ignored"}, 200
 
-    v = Vital(
-        id=uid("v"),
-        patient_id=patient_id,
-        timestamp=data["timestamp"],
-        heart_rate=data.get("heart_rate"),
-        bp_systolic=(data.get("bp") or {}).get("systolic"),
-        bp_diastolic=(data.get("bp") or {}).get("diastolic"),
-        spo2=data.get("spo2"),
-        temp=data.get("temp"),
-        device_id=data["device_id"],
-    )
+    v = Vital(**vital_row(patient_id, data))
     db.session.add(v)
-    db.session.commit()
+    try:
+        db.session.commit()  # idempotency row + vital in one transaction
+    except Exception:
+        db.session.rollback()
+        release_idempotency(data["device_id"], idem)
+        raise
+    invalidate_latest(patient_id)
     return {"vital_id": v.id, "status": "stored"}, 201
 
+@app.post("/api/v1/patients/<patient_id>/vitals:batch")
+def post_vitals_batch(patient_id):
+    """
+    Ingest a JSON array of vital-sign records in a single transaction.
+    Each item may carry its own idempotency_key; duplicates are skipped.
+    """
+    ok, resp = require_device_api_key()
+    if not ok:
+        return resp
+    raw = request.get_json(silent=True)
+    if isinstance(raw, list) and len(raw) > MAX_BATCH_SIZE:
+        return error("validation_error", 400, f"Batch exceeds {MAX_BATCH_SIZE} readings")
+    try:
+        records = load_vitals(raw)
+    except ValidationError as e:
+        return error("validation_error", 400, "Invalid payload", e.messages)
+
+    rows, staged = [], []
+    for data in records:
+        idem = data.get("idempotency_key")
+        if stage_idempotency(data["device_id"], idem):
+            rows.append(vital_row(patient_id, data))
+            staged.append((data["device_id"], idem))
+    try:
+        if rows:
+            db.session.execute(Vital.__table__.insert(), rows)
+        db.session.commit()  # idempotency rows + vitals in one transaction
+    except Exception:
+        db.session.rollback()
+        for device_id, idem in staged:
+            release_idempotency(device_id, idem)
+        raise
+    if rows:
+        invalidate_latest(patient_id)
+    return {
+        "vital_ids": [row["id"] for row in rows],
+        "stored": len(rows),
+        "duplicates_ignored": len(records) - len(rows)
+    }, 201
+
 @app.get("/api/v1/patients/<patient_id>/latest")
 def get_latest(patient_id):
-    """Return the most recent vital-sign reading for the patient."""
-    v = Vital.query.filter_by(patient_id=patient_id).order_by(Vital.timestamp.desc()).first()
-    if not v:
+    """Return the most recent vital-sign reading for the patient (Redis-cached when configured)."""
+    cache_key = None
+    if redis_client is not None:
+        try:
+            cache_key = latest_cache_key(patient_id)
+            cached = redis_client.get(cache_key)
+        except redis.RedisError as e:
+            app.logger.warning("latest cache read failed, using SQLite: %s", e)
+            cache_key = None
+        else:
+            if cached is not None:
+                return app.response_class(cached, mimetype="application/json")
+    row = (
+        db.session.query(*VITAL_COLUMNS)
+        .filter(Vital.patient_id == patient_id)
+        .order_by(Vital.timestamp.desc(), Vital.id.desc())
+        .first()
+    )
+    if not row:
         return error("not_found", 404, "No readings for patient")
-    bp = None
-    if v.bp_systolic is not None and v.bp_diastolic is not None:
-        bp = {"systolic": v.bp_systolic, "diastolic": v.bp_diastolic}
-    return {
-        "timestamp": v.timestamp.isoformat() + "Z",
-        "heart_rate": v.heart_rate,
-        "bp": bp,
-        "spo2": v.spo2,
-        "temp": v.temp,
-        "device_id": v.device_id
-    }, 200
+    ts, hr, sys_, dia, sp, t, did = row
+    payload = {
+        "timestamp": format_epoch_ms(ts),
+        "heart_rate": hr,
+        "bp": {"systolic": sys_, "diastolic": dia} if sys_ is not None and dia is not None else None,
+        "spo2": sp,
+        "temp": t,
+        "device_id": did
+    }
+    if cache_key is not None:
+        try:
+            redis_client.set(cache_key, app.json.dumps(payload), ex=LATEST_CACHE_TTL)
+        except redis.RedisError as e:
+            app.logger.warning("latest cache backfill failed: %s", e)
+    return payload, 200
 
 @app.get("/api/v1/patients/<patient_id>/history")
 def get_history(patient_id):
-    """Paginated historical readings with optional from/to filters."""
+    """
+    Paginated historical readings (newest first) with optional from/to filters.
+    from/to/cursor accept ISO-8601 or UTC epoch milliseconds.
+    - cursor: keyset pagination; pass the previous response's next_cursor
+              ("<epoch_ms>:<vital_id>", so readings sharing a timestamp are not skipped).
+    - page  : legacy offset pagination, used only when no cursor is given.
+    - include_total=1: also run COUNT(*) and return "total" (skipped by default).
+    """
     try:
-        dt_from = parse_dt(request.args.get("from")) if request.args.get("from") else None
-        dt_to   = parse_dt(request.args.get("to")) if request.args.get("to") else None
+        ms_from = parse_ts_ms(request.args.get("from"))
+        ms_to   = parse_ts_ms(request.args.get("to"))
+        cursor  = parse_cursor(request.args.get("cursor"))
         page = max(int(request.args.get("page", 1)), 1)
         size = min(max(int(request.args.get("page_size", 100)), 1), 500)
 
-        q = Vital.query.filter_by(patient_id=patient_id)
-        if dt_from:
-            q = q.filter(Vital.timestamp >= dt_from)
-        if dt_to:
-            q = q.filter(Vital.timestamp <= dt_to)
-        total = q.count()
-        q = q.order_by(Vital.timestamp.desc()).offset((page - 1) * size).limit(size)
-
-        items = []
-        for v in q.all():
-            bp = None
-            if v.bp_systolic is not None and v.bp_diastolic is not None:
-                bp = {"systolic": v.bp_systolic, "diastolic": v.bp_diastolic}
-            items.append({
-                "timestamp": v.timestamp.isoformat() + "Z",
-                "heart_rate": v.heart_rate,
-                "bp": bp,
-                "spo2": v.spo2,
-                "temp": v.temp,
-                "device_id": v.device_id
-            })
-        return {"results": items, "page": page, "page_size": size, "total": total}, 200
+        q = db.session.query(*VITAL_COLUMNS, Vital.id).filter(Vital.patient_id == patient_id)
+        if ms_from is not None:
+            q = q.filter(Vital.timestamp >= ms_from)
+        if ms_to is not None:
+            q = q.filter(Vital.timestamp <= ms_to)
+        total = q.count() if request.args.get("include_total") == "1" else None
+        q = q.order_by(Vital.timestamp.desc(), Vital.id.desc())
+        if cursor is not None:
+            # Seek past the last row seen instead of walking (page - 1) * size rows
+            c_ts, c_id = cursor
+            if c_id is None:
+                q = q.filter(Vital.timestamp < c_ts)
+            else:
+                q = q.filter(or_(Vital.timestamp < c_ts, and_(Vital.timestamp == c_ts, Vital.id < c_id)))
+            q = q.limit(size)
+        else:
+            q = q.offset((page - 1) * size).limit(size)
+
+        rows = q.all()
+        items = [{
+            "timestamp": format_epoch_ms(ts),
+            "heart_rate": hr,
+            "bp": {"systolic": sys_, "diastolic": dia} if sys_ is not None and dia is not None else None,
+            "spo2": sp,
+            "temp": t,
+            "device_id": did
+        } for ts, hr, sys_, dia, sp, t, did, _ in rows]
+        has_more = len(items) == size
+        payload = {
+            "results": items, "page": page, "page_size": size, "has_more": has_more,
+            "next_cursor": f"{rows[-1].timestamp}:{rows[-1].id}" if has_more else None
+        }
+        if total is not None:
+            payload["total"] = total
+        return payload, 200
     except Exception as e:
         return error("bad_request", 400, "Invalid query parameters", str(e))
 
@@ -308,6 +758,7 @@ def home():
             "/admin/routes",
             "/api/v1/devices/register",
             "/api/v1/patients/{id}/vitals",
+            "/api/v1/patients/{id}/vitals:batch",
             "/api/v1/patients/{id}/latest",
             "/api/v1/patients/{id}/history",
             "/debug/echo"
@@ -341,6 +792,9 @@ def echo():
 
 # ------------------------- ENTRY POINT -------------------------
 if __name__ == "__main__":
+    if IS_PROD:
+        # The Werkzeug dev server is single-process; use a real WSGI server instead
+        raise SystemExit("ENV=prod: run 'gunicorn -k gthread -w $(nproc) --threads 8 -t 30 wsgi:app'")
     print("Starting Smart Hospital API from:", os.path.abspath(__file__))
     port = int(os.getenv("PORT", 8000))
     app.run(host="0.0.0.0", port=port, debug=True)
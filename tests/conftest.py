@@ -1,28 +1,111 @@
 import os, sys, importlib
 from pathlib import Path
 import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import scoped_session, sessionmaker
 
-@pytest.fixture()
-def app_module(tmp_path, monkeypatch):
-    db_path = tmp_path / "test.db"
-    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
-    monkeypatch.setenv("DEVICE_MASTER_KEY", "test-master-key")
+root = Path(__file__).resolve().parents[1]
+if str(root) not in sys.path:
+    sys.path.insert(0, str(root))
 
-    root = Path(__file__).resolve().parents[1]
-    if str(root) not in sys.path:
-        sys.path.insert(0, str(root))
+def pytest_configure(config):
+    # app reads its config at import time, so set it before the first import.
+    # In-memory SQLite: Flask-SQLAlchemy binds it with StaticPool and
+    # check_same_thread=False, so every session shares one connection. Each
+    # pytest-xdist worker is its own process and so gets its own database.
+    os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+    os.environ["DEVICE_MASTER_KEY"] = "test-master-key"
 
+@pytest.fixture(scope="session")
+def app_module():
+    """Import the app once per session and create the schema once."""
     app_module = importlib.import_module("app")
-    importlib.reload(app_module)
-    return app_module
+    app, db = app_module.app, app_module.db
+    with app.app_context():
+        # pysqlite starts transactions lazily, which breaks SAVEPOINT nesting;
+        # let SQLAlchemy emit BEGIN itself (SQLAlchemy's documented recipe).
+        @event.listens_for(db.engine, "connect")
+        def _disable_pysqlite_begin(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(db.engine, "begin")
+        def _emit_begin(conn):
+            conn.exec_driver_sql("BEGIN")
+
+        db.create_all()
+    yield app_module
+    with app.app_context():
+        db.drop_all()
+
+@pytest.fixture(scope="session")
+def db_connection(app_module):
+    """One connection + outer transaction for the whole session, rolled back at the end."""
+    app, db = app_module.app, app_module.db
+    mp = pytest.MonkeyPatch()
+    with app.app_context():
+        connection = db.engine.connect()
+    transaction = connection.begin()
+    # App commits only release a SAVEPOINT inside the outer transaction
+    session = scoped_session(sessionmaker(bind=connection, join_transaction_mode="create_savepoint"))
+    mp.setattr(db, "session", session)
+    # /admin/init-db calls db.create_all(); keep it on the test connection
+    mp.setattr(db, "create_all", lambda *a, **kw: db.metadata.create_all(bind=connection))
+    # No app context is held open here: each request must push (and tear down)
+    # its own, which is what closes db.session between requests.
+    yield connection
+    session.remove()
+    transaction.rollback()
+    connection.close()
+    mp.undo()
+
+@pytest.fixture(scope="session")
+def registered_device(app_module, db_connection):
+    """Register dev-smoke once; it lives in the outer transaction, outside per-test rollback."""
+    with app_module.app.test_client() as client:
+        resp = client.post(
+            "/api/v1/devices/register",
+            json={"device_id": "dev-smoke", "type": "multi", "patient_id": "p_smoke"},
+            headers={"X-API-Key": "test-master-key"},
+        )
+    assert resp.status_code == 201
+    return resp.get_json()
 
 @pytest.fixture()
-def client(app_module):
+def client(app_module, db_connection):
+    """Test client whose DB work is rolled back to a SAVEPOINT after each test."""
     app = app_module.app
-    db = app_module.db
+    nested = db_connection.begin_nested()
     with app.test_client() as client:
-        with app.app_context():
-            db.create_all()
-            yield client
-            db.session.remove()
-            db.drop_all()
+        yield client
+    app_module.db.session.remove()
+    nested.rollback()
+    app_module._lookup_device_by_key.cache_clear()
+
+class FakeRedis:
+    """Dict-backed stand-in for the redis.Redis calls the app makes (no expiry)."""
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode()
+        return True
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def incr(self, key):
+        value = int(self.data.get(key, 0)) + 1
+        self.data[key] = str(value).encode()
+        return value
+
+@pytest.fixture()
+def fake_redis(app_module, monkeypatch):
+    """Route the app's Redis calls (idempotency, /latest cache) to a FakeRedis."""
+    fake = FakeRedis()
+    monkeypatch.setattr(app_module, "redis_client", fake)
+    return fake
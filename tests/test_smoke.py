@@ -1,4 +1,16 @@
-import json
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+AUTH_HEADERS = {"X-API-Key": "test-master-key"}
+REG_PAYLOAD = {"device_id": "dev-smoke", "type": "multi", "patient_id": "p_smoke"}
+VITAL_BODY = {
+    "timestamp": "2025-08-13T12:00:00Z",
+    "heart_rate": 72,
+    "bp": {"systolic": 118, "diastolic": 76},
+    "spo2": 97,
+    "temp": 36.8,
+    "device_id": "dev-smoke",
+}
 
 def test_health_ok(client):
     resp = client.get("/health")
@@ -14,41 +26,17 @@ def test_init_db_and_latest_404(client):
     assert resp.status_code == 404
     assert resp.get_json()["code"] == "not_found"
 
-def test_register_post_vitals_latest_and_idempotency(client):
-    payload = {"device_id": "dev-smoke", "type": "multi", "patient_id": "p_smoke"}
-    resp = client.post(
-        "/api/v1/devices/register",
-        data=json.dumps(payload),
-        headers={"Content-Type": "application/json", "X-API-Key": "test-master-key"},
-    )
-    assert resp.status_code in (200, 201)
-    reg = resp.get_json()
-    assert reg["device_id"] == "dev-smoke"
-    assert "api_key" in reg
-
-    vital_body = {
-        "timestamp": "2025-08-13T12:00:00Z",
-        "heart_rate": 72,
-        "bp": {"systolic": 118, "diastolic": 76},
-        "spo2": 97,
-        "temp": 36.8,
-        "device_id": "dev-smoke",
-    }
+def test_register_post_vitals_latest_and_idempotency(client, registered_device):
+    assert registered_device["device_id"] == "dev-smoke"
+    assert "api_key" in registered_device
+
     idem = "reading-2025-08-13T12:00:00Z-dev-smoke"
 
-    r1 = client.post(
-        "/api/v1/patients/p_smoke/vitals",
-        data=json.dumps(vital_body),
-        headers={"Content-Type": "application/json", "X-API-Key": "test-master-key", "Idempotency-Key": idem},
-    )
+    r1 = client.post("/api/v1/patients/p_smoke/vitals", json=VITAL_BODY, headers=AUTH_HEADERS | {"Idempotency-Key": idem})
     assert r1.status_code == 201
     assert r1.get_json()["status"] == "stored"
 
-    r2 = client.post(
-        "/api/v1/patients/p_smoke/vitals",
-        data=json.dumps(vital_body),
-        headers={"Content-Type": "application/json", "X-API-Key": "test-master-key", "Idempotency-Key": idem},
-    )
+    r2 = client.post("/api/v1/patients/p_smoke/vitals", json=VITAL_BODY, headers=AUTH_HEADERS | {"Idempotency-Key": idem})
     assert r2.status_code == 200
     assert r2.get_json()["status"] == "duplicate_ignored"
 
@@ -60,3 +48,212 @@ def test_register_post_vitals_latest_and_idempotency(client):
     assert doc["spo2"] == 97
     assert doc["temp"] == 36.8
     assert doc["device_id"] == "dev-smoke"
+
+def test_device_api_key_auth(client, registered_device, app_module):
+    lookup = app_module._lookup_device_by_key
+    bad = client.post("/api/v1/patients/p_smoke/vitals", json=VITAL_BODY, headers={"X-API-Key": "key_unknown"})
+    assert bad.status_code == 401
+    assert bad.get_json()["code"] == "invalid_api_key"
+    assert lookup.cache_info().currsize == 0  # unknown keys are not cached
+
+    device_headers = {"X-API-Key": registered_device["api_key"]}
+    resp = client.post("/api/v1/patients/p_smoke/vitals", json=VITAL_BODY, headers=device_headers)
+    assert resp.status_code == 201
+    assert resp.get_json()["status"] == "stored"
+    assert lookup.cache_info().currsize == 1
+
+    again = client.post("/api/v1/devices/register", json=REG_PAYLOAD, headers=AUTH_HEADERS)
+    assert again.status_code == 200
+    assert again.get_json() == {
+        "device_id": "dev-smoke", "api_key": registered_device["api_key"], "status": "already_registered"
+    }
+
+def test_history_cursor_pagination(client):
+    for minute in range(3):
+        body = {"timestamp": f"2025-08-13T12:0{minute}:00Z", "heart_rate": 70 + minute, "device_id": "dev-hist"}
+        resp = client.post("/api/v1/patients/p_hist/vitals", json=body, headers=AUTH_HEADERS)
+        assert resp.status_code == 201
+
+    first = client.get("/api/v1/patients/p_hist/history?page_size=2").get_json()
+    assert [r["heart_rate"] for r in first["results"]] == [72, 71]
+    assert first["next_cursor"].startswith("1755086460000:")  # "<epoch ms of 12:01:00Z>:<vital id>"
+
+    second = client.get(f"/api/v1/patients/p_hist/history?page_size=2&cursor={first['next_cursor']}").get_json()
+    assert [r["heart_rate"] for r in second["results"]] == [70]
+    assert second["next_cursor"] is None
+    assert second["has_more"] is False
+    assert "total" not in second
+
+    counted = client.get("/api/v1/patients/p_hist/history?include_total=1").get_json()
+    assert counted["total"] == 3
+
+    # from/to accept epoch milliseconds as well as ISO-8601 (12:01:00Z == 1755086460000)
+    ranged = client.get("/api/v1/patients/p_hist/history?from=1755086460000&to=2025-08-13T12:01:00Z").get_json()
+    assert [r["timestamp"] for r in ranged["results"]] == ["2025-08-13T12:01:00Z"]
+
+    # A bare timestamp cursor still seeks strictly before it
+    legacy = client.get("/api/v1/patients/p_hist/history?cursor=2025-08-13T12:01:00Z").get_json()
+    assert [r["heart_rate"] for r in legacy["results"]] == [70]
+
+def test_history_cursor_keeps_tied_timestamps(client):
+    # Three devices report the same instant; the page boundary falls between them
+    for device_id, hr in (("dev-hr", 60), ("dev-spo2", 61), ("dev-bp", 62)):
+        body = {"timestamp": "2025-08-13T12:00:00Z", "heart_rate": hr, "device_id": device_id}
+        resp = client.post("/api/v1/patients/p_tie/vitals", json=body, headers=AUTH_HEADERS)
+        assert resp.status_code == 201
+
+    first = client.get("/api/v1/patients/p_tie/history?page_size=2").get_json()
+    second = client.get(f"/api/v1/patients/p_tie/history?page_size=2&cursor={first['next_cursor']}").get_json()
+    assert len(first["results"]) == 2
+    assert len(second["results"]) == 1
+    assert sorted(r["heart_rate"] for r in first["results"] + second["results"]) == [60, 61, 62]
+
+def test_post_vitals_batch(client):
+    batch = [
+        {"timestamp": "2025-08-13T12:00:00Z", "heart_rate": 70, "device_id": "dev-batch", "idempotency_key": "b-1"},
+        {"timestamp": "2025-08-13T12:01:00Z", "heart_rate": 71, "device_id": "dev-batch", "idempotency_key": "b-2"},
+        {"timestamp": "2025-08-13T12:01:00Z", "heart_rate": 71, "device_id": "dev-batch", "idempotency_key": "b-2"},
+    ]
+    resp = client.post("/api/v1/patients/p_batch/vitals:batch", json=batch, headers=AUTH_HEADERS)
+    assert resp.status_code == 201
+    doc = resp.get_json()
+    assert doc["stored"] == 2
+    assert doc["duplicates_ignored"] == 1
+
+    latest = client.get("/api/v1/patients/p_batch/latest").get_json()
+    assert latest["heart_rate"] == 71
+
+def test_post_vitals_validation_error(client):
+    body = {"timestamp": "not-a-date", "bp": {"systolic": 400}, "device_id": "dev-bad"}
+    resp = client.post("/api/v1/patients/p_bad/vitals", json=body, headers=AUTH_HEADERS)
+    assert resp.status_code == 400
+    details = resp.get_json()["details"]
+    assert details["timestamp"] == ["Not a valid datetime."]
+    assert set(details["bp"]) == {"systolic", "diastolic"}
+
+@pytest.mark.parametrize("field, value, message", [
+    ("timestamp", "2025-08-13", "Not a valid datetime."),        # date only
+    ("timestamp", "20250813T120000", "Not a valid datetime."),   # ISO basic format
+    ("device_id", None, "Field may not be null."),
+])
+def test_post_vitals_rejects_like_schema(client, field, value, message):
+    body = VITAL_BODY | {"device_id": "dev-bad", field: value}
+    resp = client.post("/api/v1/patients/p_bad/vitals", json=body, headers=AUTH_HEADERS)
+    assert resp.status_code == 400
+    assert resp.get_json()["details"] == {field: [message]}
+
+@pytest.mark.parametrize("timestamp, expected", [
+    ("2025-08-13T12:00:00.25Z", "2025-08-13T12:00:00.250000Z"),  # 2-digit fraction
+    ("2025-08-13T17:30:00+0530", "2025-08-13T12:00:00Z"),        # offset without colon
+])
+def test_post_vitals_accepts_iso_variants(client, timestamp, expected):
+    body = VITAL_BODY | {"timestamp": timestamp, "device_id": "dev-iso"}
+    resp = client.post("/api/v1/patients/p_iso/vitals", json=body, headers=AUTH_HEADERS)
+    assert resp.status_code == 201
+    assert client.get("/api/v1/patients/p_iso/latest").get_json()["timestamp"] == expected
+
+def test_post_vitals_idempotency_key_in_body(client):
+    body = {"timestamp": "2025-08-13T12:00:00Z", "heart_rate": 60, "device_id": "dev-body", "idempotency_key": "k-1"}
+    r1 = client.post("/api/v1/patients/p_body/vitals", json=body, headers=AUTH_HEADERS)
+    r2 = client.post("/api/v1/patients/p_body/vitals", json=body, headers=AUTH_HEADERS)
+    assert r1.status_code == 201
+    assert r2.get_json()["status"] == "duplicate_ignored"
+
+def test_json_provider_is_orjson(app_module):
+    pytest.importorskip("orjson")
+    app = app_module.app
+    assert isinstance(app.json, app_module.OrjsonProvider)
+    # index-keyed batch errors need non-string keys
+    assert app.json.loads(app.json.dumps({0: {"a": [1]}})) == {"0": {"a": [1]}}
+
+# vital as created by releases that stored timestamps as DATETIME text
+LEGACY_VITAL_DDL = """
+CREATE TABLE vital (
+    id VARCHAR NOT NULL, patient_id VARCHAR, timestamp DATETIME,
+    heart_rate INTEGER, bp_systolic INTEGER, bp_diastolic INTEGER,
+    spo2 INTEGER, "temp" FLOAT, device_id VARCHAR, PRIMARY KEY (id)
+)
+"""
+
+def test_init_db_upgrades_legacy_text_timestamps(client, db_connection, app_module):
+    db_connection.exec_driver_sql("DROP TABLE vital")
+    db_connection.exec_driver_sql(LEGACY_VITAL_DDL)
+    db_connection.exec_driver_sql("CREATE INDEX ix_vital_patient_id ON vital (patient_id)")
+    db_connection.exec_driver_sql("PRAGMA user_version = 0")
+    db_connection.exec_driver_sql(
+        "INSERT INTO vital (id, patient_id, timestamp, heart_rate, device_id) "
+        "VALUES ('v_old', 'p_legacy', '2025-08-13 12:00:00.250000', 65, 'dev-old')"
+    )
+
+    assert client.post("/admin/init-db").status_code == 201
+    indexes = {r[0] for r in db_connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE tbl_name = 'vital'")}
+    assert "ix_vital_patient_ts_id" in indexes
+    assert "ix_vital_patient_id" not in indexes
+    assert db_connection.exec_driver_sql("PRAGMA user_version").scalar() == app_module.SCHEMA_VERSION
+
+    # An older reading posted after the upgrade must not sort above the converted one
+    body = {"timestamp": "2025-08-13T11:00:00Z", "heart_rate": 80, "device_id": "dev-new"}
+    assert client.post("/api/v1/patients/p_legacy/vitals", json=body, headers=AUTH_HEADERS).status_code == 201
+
+    latest = client.get("/api/v1/patients/p_legacy/latest")
+    assert latest.status_code == 200
+    assert latest.get_json()["timestamp"] == "2025-08-13T12:00:00.250000Z"
+    history = client.get("/api/v1/patients/p_legacy/history").get_json()
+    assert [r["heart_rate"] for r in history["results"]] == [65, 80]
+
+@pytest.mark.parametrize("path, payload", [
+    ("vitals", VITAL_BODY | {"device_id": "dev-retry", "idempotency_key": "retry-1"}),
+    ("vitals:batch", [VITAL_BODY | {"device_id": "dev-retry", "idempotency_key": "retry-1"}]),
+])
+@pytest.mark.parametrize("exc_type", [OperationalError, IntegrityError])
+def test_redis_idempotency_key_released_when_commit_fails(client, fake_redis, app_module, monkeypatch, path, payload, exc_type):
+    session = app_module.db.session
+    real_commit = session.commit
+
+    def commit_fails_once():
+        monkeypatch.setattr(session, "commit", real_commit)
+        raise exc_type("COMMIT", {}, Exception("commit failed"))
+
+    monkeypatch.setattr(session, "commit", commit_fails_once)
+    url = f"/api/v1/patients/p_retry/{path}"
+    assert client.post(url, json=payload, headers=AUTH_HEADERS).status_code == 500
+    assert not any(key.startswith("idem:") for key in fake_redis.data)
+
+    # The retry is stored rather than reported as a duplicate
+    retry = client.post(url, json=payload, headers=AUTH_HEADERS)
+    assert retry.status_code == 201
+    assert client.get("/api/v1/patients/p_retry/latest").status_code == 200
+
+def test_latest_redis_cache(client, fake_redis, app_module, monkeypatch):
+    pytest.importorskip("redis")
+    url = "/api/v1/patients/p_cache/latest"
+    body = VITAL_BODY | {"device_id": "dev-cache"}
+    assert client.post("/api/v1/patients/p_cache/vitals", json=body, headers=AUTH_HEADERS).status_code == 201
+
+    # Miss: read from SQLite and backfilled under the current generation key
+    assert client.get(url).get_json()["heart_rate"] == 72
+    cache_key = app_module.latest_cache_key("p_cache")
+    assert cache_key in fake_redis.data
+
+    # Hit: served from Redis without touching SQLite
+    fake_redis.data[cache_key] = b'{"heart_rate": 1}'
+    assert client.get(url).get_json() == {"heart_rate": 1}
+
+    # A new reading moves readers to a fresh key
+    newer = body | {"timestamp": "2025-08-13T12:05:00Z", "heart_rate": 90}
+    assert client.post("/api/v1/patients/p_cache/vitals", json=newer, headers=AUTH_HEADERS).status_code == 201
+    assert app_module.latest_cache_key("p_cache") != cache_key
+    assert client.get(url).get_json()["heart_rate"] == 90
+
+    # A backfill computed before that write lands under the retired key
+    fake_redis.set(cache_key, b'{"heart_rate": 72}')
+    assert client.get(url).get_json()["heart_rate"] == 90
+
+    # Redis outage: fall back to SQLite
+    def unavailable(*args, **kwargs):
+        raise app_module.redis.ConnectionError("redis down")
+    monkeypatch.setattr(fake_redis, "get", unavailable)
+    monkeypatch.setattr(fake_redis, "set", unavailable)
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp.get_json()["heart_rate"] == 90
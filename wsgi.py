@@ -1,9 +1,20 @@
 # wsgi.py  (WSGI entrypoint)
-from app import app  # expose the Flask application as "app"
+from app import app, IS_PROD  # expose the Flask application as "app"
 
-# Do NOT call app.run() when imported by a WSGI server.
-# Optionally allow direct run for quick local checks:
+# Do NOT call app.run() when imported by a WSGI server. In production run e.g.:
+#   gunicorn -k gthread -w $(nproc) --threads 8 -t 30 wsgi:app
+# (or gunicorn -k uvicorn.workers.UvicornWorker behind an ASGI adapter for an
+# event-loop server on modern Linux kernels).
+# Direct run for quick local checks: serve with waitress when installed,
+# else fall back to the Werkzeug dev server (threaded, but not for production).
 if __name__ == "__main__":
     import os
     port = int(os.getenv("PORT", 8000))
-    app.run(host="0.0.0.0", port=port, debug=False)
+    try:
+        from waitress import serve
+    except ImportError:
+        if IS_PROD:
+            raise SystemExit("ENV=prod: install waitress or run 'gunicorn -k gthread -w $(nproc) --threads 8 -t 30 wsgi:app'")
+        app.run(host="0.0.0.0", port=port, debug=False)
+    else:
+        serve(app, host="0.0.0.0", port=port, threads=8)